@@ -1,55 +1,128 @@
 import streamlit as st
 import pandas as pd
 import re
-from openai import OpenAI
+import asyncio
+import hashlib
+import json
+import httpx
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from cachetools import TTLCache
+from openai import DEFAULT_MAX_RETRIES, AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+# Errors worth retrying (429s, 5xx, network failures and timeouts). Anything else,
+# e.g. a bad request or invalid key, fails fast.
+RETRIABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+# Connection pool sized well above the concurrency limit so requests never wait on a socket.
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+HTTP_TIMEOUT = httpx.Timeout(60.0)
+
+# Precompiled patterns used when splitting input and cleaning output.
+# Quotes/hyphens and [citations] are stripped in a single pass.
+CLEAN_RE = re.compile(r'["“””-]|\[[^\]]+\]')
+KEYWORD_SEPARATOR_RE = re.compile(r'[,\n]')
+
+# Batch API job statuses after which no more results will arrive.
+FINISHED_BATCH_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Output columns, in the order the fields appear in each response line.
+COLUMNS = ['Title', 'Post Body', 'Comment 1', 'Comment 2', 'Comment 3', 'Comment 4', 'Comment 5']
+
+# Responses are reused for identical requests for a day, so reruns don't re-bill tokens.
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 86400  # seconds
 
 # --- Helper Functions ---
 
-def clean_text(text):
-    """Removes quotes, citations, and extra whitespace."""
-    text = re.sub(r'["“””-]', '', text)
-    text = re.sub(r'\[[^\]]+\]', '', text)
-    return text.strip()
+def get_response_cache():
+    """Returns this session's API response cache, creating it on first use."""
+    if 'response_cache' not in st.session_state:
+        st.session_state.response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+    return st.session_state.response_cache
+
+def request_cache_key(**request):
+    """Hashes the request parameters (model, messages, ...) into a cache key."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(min=1, max=30),
+    retry=retry_if_exception_type(RETRIABLE_ERRORS),
+    reraise=True,
+)
+async def create_chat_completion(client, **kwargs):
+    """Calls the chat completions endpoint, retrying transient errors with jittered backoff."""
+    return await client.chat.completions.create(**kwargs)
 
-def openai_gpt_request(api_key, prompt, model="gpt-4o"): # or "gpt-4"
-    """Makes a request to the OpenAI GPT-4 API."""
-    client = OpenAI(api_key=api_key)
+def build_request(prompt, model="gpt-4o"): # or "gpt-4"
+    """Builds the chat completion parameters for a prompt."""
     messages = [
         {"role": "system", "content": "You are a helpful assistant. Be precise and follow instructions EXACTLY."},
         {"role": "user", "content": prompt}
     ]
+    return dict(
+        model=model,
+        messages=messages,
+        temperature=0.7,  # Adjust for creativity (0.0 is deterministic, 1.0 is most creative)
+    )
+
+async def openai_gpt_request(client, prompt, model="gpt-4o"): # or "gpt-4"
+    """Makes an async request to the OpenAI GPT-4 API using a shared client."""
+    request = build_request(prompt, model)
+    cache = get_response_cache()
+    key = request_cache_key(**request)
+    if key in cache:
+        return cache[key]
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.7,  # Adjust for creativity (0.0 is deterministic, 1.0 is most creative)
-        )
-        return response.choices[0].message.content
+        stream = await create_chat_completion(client, stream=True, **request)
+        chunks = []
+        async for chunk in stream:
+            if chunk.choices:
+                chunks.append(chunk.choices[0].delta.content or '')
+        content = ''.join(chunks)
+        if content:
+            cache[key] = content
+        return content
     except Exception as e:
         st.error(f"Error from OpenAI API: {e}")
         return None
 
-def generate_content(api_key, company_name, keywords, debug_mode=False):
-    """Generates content for each keyword, using OpenAI GPT-4."""
-    all_posts = []
-    keyword_batches = [keywords[i:i + 1] for i in range(0, len(keywords), 1)]  # Batch size of 1 (or adjust)
+def make_client(api_key, max_retries=0):
+    """Creates the AsyncOpenAI client shared by every request in a generation run.
+
+    The client is not cached across runs: its connection pool is bound to the event
+    loop, and each run gets a fresh loop from asyncio.run.
+
+    SDK retries are off by default because chat completions are retried by
+    create_chat_completion; pass max_retries for calls that don't go through it.
+    """
+    http_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    return AsyncOpenAI(api_key=api_key, max_retries=max_retries, http_client=http_client)
 
-    for batch in keyword_batches:
-        for keyword in batch: #now we can simply iterate
-            prompt = f"""
+def batch_keywords(keywords, batch_size):
+    """Splits keywords into consecutive batches of at most batch_size, one per request."""
+    return [keywords[i:i + batch_size] for i in range(0, len(keywords), batch_size)]
+
+def build_prompt(company_name, keywords):
+    """Builds the prompt for a batch of keywords, one post per keyword."""
+    keyword_list = "\n".join(f"{i}. **{keyword}**" for i, keyword in enumerate(keywords, 1))
+    return f"""
 Context: You are generating content for a new internal Intrafeed at {company_name}. Employees won't contribute if they don't see content, so you must 'seed' the platform.
 
 ABSOLUTE OUTPUT FORMAT REQUIREMENTS:
 - Output MUST be plain text.
-- Output MUST consist of EXACTLY ONE line.
-- The line MUST contain the following fields, separated by '|||': Title, Post Body, Comment 1, Comment 2, Comment 3, Comment 4, Comment 5
+- Output MUST consist of EXACTLY {len(keywords)} line(s), one per keyword, in the order the keywords are listed.
+- Each line MUST contain the following fields, separated by '|||': Title, Post Body, Comment 1, Comment 2, Comment 3, Comment 4, Comment 5
 - There MUST be NO other text before, after, or between the data fields. NO headers. NO explanations. NO newlines within a field.
 - Example: Title|||Post Body|||Comment 1|||Comment 2|||Comment 3|||Comment 4|||Comment 5
 
 Directives:
-- Create one post based on the keyword: **{keyword}**
+- Create one post for EACH of the following keywords:
+{keyword_list}
 - Post should not look AI generated and should mimic a reddit style post
-- Include the keyword in the Title, Post Body, and all Comments.
+- Include the post's keyword in its Title, Post Body, and all Comments.
 - Comments should be atleast 150 words aim for that 
 - The post should be in a Reddit style.
 - Some posts should have typos or informal language (like Hinglish if {company_name} is Indian).
@@ -64,47 +137,158 @@ Directives:
 - Posts should be anonymous. No usernames. No hashtags.
 - Comments must vary in tone, style, and content.
 """
-            response_text = openai_gpt_request(api_key, prompt)
-            if response_text:
-                if debug_mode:
-                    print(f"----- Raw Response for keyword '{keyword}': -----\n{response_text}")
-                all_posts.append(response_text)
+
+async def generate_content(api_key, company_name, keywords, debug_mode=False, max_concurrency=10, batch_size=5,
+                           on_progress=None):
+    """Generates content for all keyword batches concurrently, using OpenAI GPT-4.
+
+    on_progress, if given, is called with (keywords done, total keywords) as each batch finishes.
+    """
+    all_posts = []
+    keyword_batches = batch_keywords(keywords, batch_size)
+    semaphore = asyncio.Semaphore(max_concurrency)  # Caps in-flight requests to stay under rate limits
+
+    # One client shared by every request, so connections are pooled.
+    async with make_client(api_key) as client:
+        async def limited_request(index, batch):
+            try:
+                async with semaphore:
+                    return index, await openai_gpt_request(client, build_prompt(company_name, batch))
+            except Exception as e:
+                return index, e
+
+        # Collect results as they finish (for progress), but keep them in keyword_batches order.
+        results = [None] * len(keyword_batches)
+        done = 0
+        tasks = [limited_request(i, batch) for i, batch in enumerate(keyword_batches)]
+        for next_result in asyncio.as_completed(tasks):
+            index, results[index] = await next_result
+            done += len(keyword_batches[index])
+            if on_progress:
+                on_progress(done, len(keywords))
+
+    for batch, response_text in zip(keyword_batches, results):
+        if isinstance(response_text, Exception):
+            st.error(f"Error generating content for {batch}: {response_text}")
+            continue
+        if response_text:
+            if debug_mode:
+                print(f"----- Raw Response for keywords {batch}: -----\n{response_text}")
+            all_posts.extend(response_lines(response_text))
 
     return all_posts
 
+def response_lines(response_text):
+    """Splits a batch response into its non-blank post lines."""
+    return [line for line in map(str.strip, response_text.splitlines()) if line]
+
+async def submit_batch_job(api_key, company_name, keywords, batch_size=5):
+    """Submits one request per keyword batch to the OpenAI Batch API and returns the job ID."""
+    keyword_batches = batch_keywords(keywords, batch_size)
+    requests = [
+        json.dumps({
+            "custom_id": f"batch-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": build_request(build_prompt(company_name, batch)),
+        })
+        for i, batch in enumerate(keyword_batches)
+    ]
+    async with make_client(api_key, max_retries=DEFAULT_MAX_RETRIES) as client:
+        input_file = await client.files.create(
+            file=("intrafeed_batch.jsonl", "\n".join(requests).encode()),
+            purpose="batch",
+        )
+        job = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+    return job.id
+
+async def fetch_batch_job(api_key, job_id, debug_mode=False):
+    """Checks an OpenAI Batch API job.
+
+    Returns (status, responses), where responses is None while the job is still running.
+    Once it has finished (including failed, expired or cancelled jobs), responses holds
+    whatever requests succeeded, and each failure is reported with st.error.
+    """
+    async with make_client(api_key, max_retries=DEFAULT_MAX_RETRIES) as client:
+        job = await client.batches.retrieve(job_id)
+        if job.status not in FINISHED_BATCH_STATUSES:
+            return job.status, None
+        # Successful requests are written to the output file, failed ones to the error file.
+        output = await client.files.content(job.output_file_id) if job.output_file_id else None
+        errors = await client.files.content(job.error_file_id) if job.error_file_id else None
+
+    if job.errors and job.errors.data:
+        for error in job.errors.data:
+            st.error(f"Batch job {job.status}: {error.code}: {error.message}")
+    elif job.status != "completed":
+        st.error(f"Batch job ended with status '{job.status}'; showing any requests that finished.")
+
+    results = {}
+    for result in batch_file_records(output) + batch_file_records(errors):
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            st.error(f"Batch request {result['custom_id']} failed: {result.get('error') or response.get('body')}")
+            continue
+        content = response["body"]["choices"][0]["message"]["content"]
+        if content:
+            results[result["custom_id"]] = content
+        else:  # e.g. a refusal
+            st.error(f"Batch request {result['custom_id']} returned no content.")
 
+    # Output file order is not guaranteed, so restore the submission order from custom_id.
+    all_posts = []
+    for custom_id in sorted(results, key=lambda c: int(c.split('-')[1])):
+        if debug_mode:
+            print(f"----- Raw Response for {custom_id}: -----\n{results[custom_id]}")
+        all_posts.extend(response_lines(results[custom_id]))
+    return job.status, all_posts
+
+def batch_file_records(file_content):
+    """Parses a Batch API output or error file (JSONL) into its records."""
+    if file_content is None:
+        return []
+    return [json.loads(line) for line in file_content.text.splitlines() if line.strip()]
 
+
+@st.cache_data(show_spinner=False, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
 def parse_responses(responses, debug_mode=False):
-    """Parses responses, handling variable numbers of comments."""
-    all_dfs = []
+    """Parses responses, handling variable numbers of comments.
+
+    Cached on its inputs, so pass responses as a tuple.
+    """
+    columns = {name: [] for name in COLUMNS}
     for line in responses:
         if debug_mode:
             print(f"----- Processing Line: -----\n{line}")
 
-        parts = re.split(r'\s*\|\|\|\s*', line)
+        parts = [p.strip() for p in line.split('|||')]
         parts = [p for p in parts if p]  # Remove empty strings
 
         if debug_mode:
             print(f"----- Split Parts: {parts}")
 
         if len(parts) >= 2:
-            data = {
-                'Title': [clean_text(parts[0])],
-                'Post Body': [clean_text(parts[1])],
-                'Comment 1': [clean_text(parts[2]) if len(parts) > 2 else ""],
-                'Comment 2': [clean_text(parts[3]) if len(parts) > 3 else ""],
-                'Comment 3': [clean_text(parts[4]) if len(parts) > 4 else ""],
-                'Comment 4': [clean_text(parts[5]) if len(parts) > 5 else ""],
-                'Comment 5': [clean_text(parts[6]) if len(parts) > 6 else ""],
-            }
-            df = pd.DataFrame(data)
-            all_dfs.append(df)
+            for i, values in enumerate(columns.values()):
+                values.append(parts[i] if len(parts) > i else "")
         else:
             st.warning(f"Too few fields ({len(parts)}) in line. Skipping.\nLine Snippet: {line[:100]}...")
 
-    if not all_dfs:
+    if not columns['Title']:
         return pd.DataFrame()
-    return pd.concat(all_dfs, ignore_index=True)
+    df = pd.DataFrame(columns)
+    # Remove quotes, citations, and extra whitespace from every field in one vectorized pass.
+    df[COLUMNS] = df[COLUMNS].apply(lambda col: col.str.replace(CLEAN_RE, '', regex=True).str.strip())
+    return df.astype("string[pyarrow]")  # Arrow-backed strings: less memory than object dtype
+
+def to_csv_bytes(df):
+    """Serializes the DataFrame to CSV with Arrow's C++ writer."""
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), sink)
+    return sink.getvalue().to_pybytes()
 
 
 # --- Streamlit App ---
@@ -123,9 +307,13 @@ if not st.session_state.api_key:
 # Only show the main app if the API key is set
 if st.session_state.api_key:
     debug_mode = st.checkbox("Enable Debug Mode")
+    max_concurrency = st.number_input("Max concurrent requests:", min_value=1, max_value=30, value=10, step=1)
+    batch_size = st.slider("Keywords per request:", min_value=1, max_value=10, value=5)
+    batch_mode = st.checkbox("Batch mode (OpenAI Batch API: half the cost, results within 24 hours)")
     company_name = st.text_input("Enter the company name:", value="IBM India")
     keyword_input = st.text_area("Enter keywords (comma-separated, up to 30):")
-    keywords = [k.strip() for k in re.split(r'[,\n]', keyword_input) if k.strip()]
+    # dict.fromkeys drops repeated keywords (keeping first-seen order) so each costs one request.
+    keywords = list(dict.fromkeys(k.strip() for k in KEYWORD_SEPARATOR_RE.split(keyword_input) if k.strip()))
 
     if len(keywords) > 30:
         st.warning("Max 30 keywords.")
@@ -134,22 +322,50 @@ if st.session_state.api_key:
     if st.button("Generate Content"):
         if not company_name or not keywords:
             st.error("Please enter company name and keywords.")
+        elif batch_mode:
+            with st.spinner("Submitting batch job..."):
+                try:
+                    st.session_state.batch_job_id = asyncio.run(
+                        submit_batch_job(st.session_state.api_key, company_name, keywords, batch_size)
+                    )
+                except Exception as e:
+                    st.error(f"Error submitting batch job: {e}")
         else:
             with st.spinner("Generating..."):
                 progress_bar = st.progress(0)
-                raw_responses = generate_content(st.session_state.api_key, company_name, keywords, debug_mode)
-                progress_bar.progress(50)
-                if raw_responses:
-                    df = parse_responses(raw_responses, debug_mode)
-                    progress_bar.progress(100)
-                    if not df.empty:
-                        st.dataframe(df)
-                        csv = df.to_csv(index=False)
-                        st.download_button("Download CSV", csv, 'intrafeed_content.csv', 'text/csv')
-                    else:
-                        st.error("No content generated successfully.")
+                raw_responses = asyncio.run(generate_content(
+                    st.session_state.api_key, company_name, keywords, debug_mode, int(max_concurrency), batch_size,
+                    on_progress=lambda done, total: progress_bar.progress(int(90 * done / total)),
+                ))
+                # Kept in session state so later reruns (any widget change) re-render without regenerating.
+                st.session_state.raw_responses = tuple(raw_responses)
+                progress_bar.progress(100)
+
+    if batch_mode:
+        job_id = st.text_input("Batch job ID:", value=st.session_state.get('batch_job_id', ''))
+        st.caption("Keep this ID to check on the job later, even after closing the tab.")
+        if job_id and st.button("Check Batch Job"):
+            try:
+                status, responses = asyncio.run(fetch_batch_job(st.session_state.api_key, job_id, debug_mode))
+            except Exception as e:
+                st.error(f"Error checking batch job: {e}")
+            else:
+                if responses is None:
+                    st.info(f"Batch job status: {status}")
                 else:
-                    st.error("No content generated. Check API Key/prompt.")
+                    st.session_state.raw_responses = tuple(responses)
+
+    if 'raw_responses' in st.session_state:
+        if st.session_state.raw_responses:
+            df = parse_responses(st.session_state.raw_responses, debug_mode)
+            if not df.empty:
+                st.dataframe(df)
+                csv = to_csv_bytes(df)
+                st.download_button("Download CSV", csv, 'intrafeed_content.csv', 'text/csv')
+            else:
+                st.error("No content generated successfully.")
+        else:
+            st.error("No content generated. Check API Key/prompt.")
 
 else:
     st.write("Enter your API key to begin.")